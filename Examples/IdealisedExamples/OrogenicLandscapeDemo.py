@@ -127,16 +127,24 @@ save_fields = True
 
 efficiency = fn.parameter(qg.nd(5.0e-6 / u.year))
 
-h5_filename = "fields_{:06d}.h5"
+h5_filename = "fields.h5"
 stats = "Step {:04d} | dt {:.5f} | time {:.4f} | min/mean/max height {:.3f}/{:.3f}/{:.3f} | step walltime {:.3f}"
 sim_time = 0.0
 steps = 20
 
+# the mesh geometry does not change - write it once and append a field for each step
+if save_fields:
+    mesh.save_mesh_to_hdf5(h5_filename)
+
+# work arrays for the timestepping are allocated once, outside the loop
+topography0 = np.empty_like(mesh.topography.data)
+topography1 = np.empty_like(mesh.topography.data)
+
 for i in range(steps):
     
     t = time()
     
-    topography0 = mesh.topography.copy()
+    topography0[:] = mesh.topography.data
     
     # get timestep size   
     dt = min(diffusion_solver.diffusion_timestep(), transport_solver.erosion_deposition_timestep())
@@ -148,8 +156,10 @@ for i in range(steps):
     dhdt = diffusion_rate - erosion_rate + uplift_rate #+ deposition_rate
     
     # do not rebuilt downhill matrix at half timestep
+    np.multiply(dhdt, 0.5*dt, out=topography1)
+    topography1 += topography0
     mesh.topography.unlock()
-    mesh.topography.data = mesh.topography.data + 0.5*dt*dhdt
+    mesh.topography.data = topography1
     mesh.topography.lock()
     
     # get timestep size
@@ -162,13 +172,13 @@ for i in range(steps):
     dhdt = diffusion_rate - erosion_rate + uplift_rate#+ deposition_rate
     
     # now take full timestep
+    np.multiply(dhdt, dt, out=topography1)
+    topography1 += topography0
     with mesh.deform_topography():
-        mesh.topography.data = topography0.data + dt*dhdt
+        mesh.topography.data = topography1
         
     if save_fields:
-        mesh.save_mesh_to_hdf5(h5_filename.format(i))
-        mesh.save_field_to_hdf5(h5_filename.format(i), topo=mesh.topography.data)
-        quagmire.tools.generate_xdmf(h5_filename.format(i))
+        mesh.save_field_to_hdf5(h5_filename, **{"topo_{:06d}".format(i): mesh.topography.data})
         
     sim_time += dt
     
@@ -177,3 +187,6 @@ for i in range(steps):
         simulation_time = qg.scaling.dimensionalise(sim_time, u.year)
         print(stats.format(i, dt, simulation_time, topo_scaled.min(), topo_scaled.mean(),
                            topo_scaled.max(), time() - t))
+
+if save_fields:
+    quagmire.tools.generate_xdmf(h5_filename)
@@ -215,9 +215,13 @@ lv.show()
 # Applies Lloyd's algorithm of iterated voronoi construction to improve the mesh point locations. This distributes the points to a more uniform spacing with more equant triangles. It can be very slow for anything but a small mesh. [Refining](#Mesh-refinement) the mesh a few times will produce a large, well-spaced mesh.
 
 # +
+from time import time
+
 bmask = mesh.bmask.copy()
 
+t = time()
 x1, y1 = meshtools.lloyd_mesh_improvement(x, y, bmask, iterations=3)
+lloyd_time = time() - t
 DM = meshtools.create_DMPlex_from_points(x1, y1, bmask)
 
 mesh1 = QuagMesh(DM)
@@ -279,6 +283,96 @@ ax2.set_title('improved mesh')
 plt.show()
 # -
 
+# ### Vectorised Lloyd iterations
+#
+# Each Lloyd iteration moves every (non-boundary) point to the centroid of its Voronoi cell. The Voronoi cells are the dual of the Delaunay triangulation: every triangle contributes a piece of the cell of each of its three vertices bounded by the vertex, the midpoints of its two edges and the circumcentre of the triangle. Splitting that piece into two triangles (with signed areas, since the circumcentre of an obtuse triangle lies outside it) means the area and centroid of every cell can be accumulated with `numpy` operations over all the triangles at once, followed by a new Delaunay triangulation of the moved points.
+#
+# Instead of a fixed number of iterations, we can stop when the largest movement is a small fraction of the typical point spacing. The timings below first compare the two implementations over the same three iterations (`tolerance=0`) and then run the vectorised version to convergence.
+
+# +
+from scipy.spatial import Delaunay
+
+def voronoi_centroids(points, simplices):
+    """
+    Area and centroid of the Voronoi cell of each point computed from the triangulation.
+    Cells of boundary points are not closed and should be ignored.
+    """
+
+    tri = simplices.copy()
+    p = points[tri]
+    cross = (p[:,1,0]-p[:,0,0])*(p[:,2,1]-p[:,0,1]) - (p[:,2,0]-p[:,0,0])*(p[:,1,1]-p[:,0,1])
+    tri[cross < 0.0] = tri[cross < 0.0][:,::-1]
+    p = points[tri]
+
+    a, b, c = p[:,0], p[:,1], p[:,2]
+    a2, b2, c2 = (a**2).sum(axis=1), (b**2).sum(axis=1), (c**2).sum(axis=1)
+    d = 2.0 * (a[:,0]*(b[:,1]-c[:,1]) + b[:,0]*(c[:,1]-a[:,1]) + c[:,0]*(a[:,1]-b[:,1]))
+    circumcentre = np.column_stack([(a2*(b[:,1]-c[:,1]) + b2*(c[:,1]-a[:,1]) + c2*(a[:,1]-b[:,1])) / d,
+                                    (a2*(c[:,0]-b[:,0]) + b2*(a[:,0]-c[:,0]) + c2*(b[:,0]-a[:,0])) / d])
+
+    npoints = points.shape[0]
+    area = np.zeros(npoints)
+    moment = np.zeros((npoints, 2))
+
+    for k in range(0, 3):
+        v = p[:,k]
+        next_midpoint = 0.5 * (v + p[:,(k+1)%3])
+        prev_midpoint = 0.5 * (v + p[:,(k+2)%3])
+
+        for q1, q2 in ((next_midpoint, circumcentre), (circumcentre, prev_midpoint)):
+            sub_area = 0.5 * ((q1[:,0]-v[:,0])*(q2[:,1]-v[:,1]) - (q2[:,0]-v[:,0])*(q1[:,1]-v[:,1]))
+            area += np.bincount(tri[:,k], weights=sub_area, minlength=npoints)
+            for dim in range(0, 2):
+                sub_moment = sub_area * (v[:,dim] + q1[:,dim] + q2[:,dim]) / 3.0
+                moment[:,dim] += np.bincount(tri[:,k], weights=sub_moment, minlength=npoints)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centroids = moment / area.reshape(-1,1)
+
+    return area, centroids
+
+
+def lloyd_relaxation(x, y, bmask, tolerance=0.01, max_iterations=50):
+    """
+    Move the points where bmask is True towards the centroids of their Voronoi cells
+    until the largest movement is less than tolerance x the mean spacing
+    """
+
+    points = np.column_stack([x, y])
+
+    for iteration in range(1, max_iterations+1):
+        area, centroids = voronoi_centroids(points, Delaunay(points).simplices)
+
+        if iteration == 1:
+            spacing = np.sqrt(area[bmask].mean())
+
+        move = np.where(bmask.reshape(-1,1), centroids - points, 0.0)
+        points += move
+
+        if np.hypot(move[:,0], move[:,1]).max() < tolerance * spacing:
+            break
+
+    return points[:,0], points[:,1], iteration
+
+
+# +
+t = time()
+lloyd_relaxation(x, y, bmask, tolerance=0.0, max_iterations=3)
+print("meshtools.lloyd_mesh_improvement - 3 iterations, {:.3f}s".format(lloyd_time))
+print("Vectorised Lloyd                 - 3 iterations, {:.3f}s".format(time() - t))
+
+t = time()
+x1v, y1v, lloyd_its = lloyd_relaxation(x, y, bmask)
+print("Vectorised Lloyd to tolerance    - {} iterations, {:.3f}s".format(lloyd_its, time() - t))
+
+DM = meshtools.create_DMPlex_from_points(x1v, y1v, bmask)
+mesh1v = QuagMesh(DM)
+mesh1v_equant = mesh1v.neighbour_cloud_distances.mean(axis=1) / ( np.sqrt(mesh1v.area))
+
+print("Equant measure (mean / std) - original {:.3f}/{:.3f} | lloyd {:.3f}/{:.3f} | vectorised {:.3f}/{:.3f}".format(
+       mesh_equant.mean(), mesh_equant.std(), mesh1_equant.mean(), mesh1_equant.std(), mesh1v_equant.mean(), mesh1v_equant.std()))
+# -
+
 # ## Mesh refinement
 #
 # Triangulating a large set of points on a single processor then distributing the mesh across multiple processors can be very slow. A more time effective workflow is to create an initial `DM` with a small number of points, then refine the mesh in parallel. This is achieved by adding the midpoint of each line segment to the mesh and can be iteratively refined until the desired level of detail is reached.
@@ -368,6 +462,67 @@ print("{} boundary points".format( len(mesh2.get_label("boundary")) ))
 set(coarse_pts0) == set(coarse_pts1) == set(coarse_pts2)
 # -
 
+# ### Smoothing a refined mesh
+#
+# Refinement preserves the shape of the coarse triangles, so a poor coarse mesh produces a poor fine mesh. The Lloyd iterations above are applied to the points before the `DM` is built, which means the whole point set has to be on one processor. Instead, we can smooth the refined mesh where it already is: the Voronoi centroids are computed from the existing triangles (no new triangulation during the iterations), only the non-boundary points are moved, and the new positions are synchronised through mesh variables so that each point is moved by the processor that owns it. The coordinates are then written back into the `DM` and the `QuagMesh` is rebuilt once.
+#
+# Without re-triangulating, the connectivity does not adapt as the points move, so only a few iterations should be used - the aim is to remove the imprint of the coarse mesh, not to find the optimal point distribution.
+
+# +
+def lloyd_smooth_in_dm(mesh, iterations=3):
+    """
+    Lloyd iterations on the existing triangulation of a mesh. Returns the new local coordinates.
+    """
+
+    points = mesh.coords.copy()
+    move_x = mesh.add_variable(name="lloyd_dx")
+    move_y = mesh.add_variable(name="lloyd_dy")
+
+    for iteration in range(0, iterations):
+        area, centroids = voronoi_centroids(points, mesh.tri.simplices)
+        move = np.where(mesh.bmask.reshape(-1,1), centroids - points, 0.0)
+
+        move_x.data = move[:,0]
+        move_y.data = move[:,1]
+        move_x.sync()
+        move_y.sync()
+
+        points[:,0] += move_x.data
+        points[:,1] += move_y.data
+
+    return points
+
+
+coords = DM_r2.getCoordinatesLocal()
+coords.setArray(lloyd_smooth_in_dm(mesh2).ravel())
+DM_r2.setCoordinatesLocal(coords)
+
+mesh2s = QuagMesh(DM_r2, verbose=False)
+
+mesh2_equant  = mesh2.neighbour_cloud_distances.mean(axis=1)  / np.sqrt(mesh2.area)
+mesh2s_equant = mesh2s.neighbour_cloud_distances.mean(axis=1) / np.sqrt(mesh2s.area)
+
+print("Equant measure (mean / std) - refined {:.3f}/{:.3f} | refined + smoothed {:.3f}/{:.3f}".format(
+       mesh2_equant.mean(), mesh2_equant.std(), mesh2s_equant.mean(), mesh2s_equant.std()))
+# -
+
+# ### Triangulation cost: root versus refinement
+#
+# `create_DMPlex_from_points` triangulates all of the points on the root processor before the mesh is distributed, so the size of the mesh is limited by the time and memory available to one process. Until a distributed triangulation is available, the way around this is the workflow in the [parallel notes](#Parallel-notes): triangulate a coarse point set on the root processor and let the (distributed) refinement produce the fine mesh. The comparison below is for meshes with roughly the same number of points. The points are generated beforehand, so only `create_DMPlex_from_points` is timed. In parallel, only the first of these grows with the number of points on the root processor.
+
+# +
+xf, yf, bmask_f = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.025, 0.025, 16000, 800)
+xc, yc, bmask_c = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 1000, 200)
+
+t = time()
+DM_fine = meshtools.create_DMPlex_from_points(xf, yf, bmask_f)
+print("Triangulated on root  - {} points, {:.3f}s".format(DM_fine.getCoordinatesLocal().getSize()//2, time()-t))
+
+t = time()
+DM_coarse = meshtools.create_DMPlex_from_points(xc, yc, bmask_c, refinement_levels=2)
+print("Coarse + 2 refinements - {} points, {:.3f}s".format(DM_coarse.getCoordinatesLocal().getSize()//2, time()-t))
+# -
+
 # ## Spherical meshes
 #
 # This unstructed mesh uses PETSc's `DMPlex` object, and uses [stripy](https://github.com/underworldcode/stripy) to triangulate on the unit sphere. Multiple meshes may be created, including:
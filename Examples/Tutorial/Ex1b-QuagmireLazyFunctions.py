@@ -228,6 +228,71 @@ tris.control.List(options=["height", "slope", "curlgrad", "dh/dy"], property="co
 lv.control.show()
 # -
 
+# ### Precomputed gradient operators
+#
+# Every evaluation of a gradient function recomputes the derivatives from scratch. When the same derivatives are needed many times on a fixed mesh (e.g. the slope in a timestepping loop), it can be more efficient to build sparse matrices $D_x$ and $D_y$ once and then obtain the gradient of any field with a sparse matrix-vector product. Here we use the gradient of the linear interpolant on each triangle, averaged to the nodes with area weights. This is only first order accurate on an irregular mesh (the spline gradients are more accurate) but it is very cheap to apply.
+#
+# Several fields can be differentiated at once by stacking them as the columns of an array, and compound operators like $\nabla \cdot \nabla$ can be formed once as a matrix product.
+
+# +
+from scipy import sparse
+
+def gradient_operators(mesh):
+    """
+    Sparse matrices Dx, Dy that map nodal values to the area-weighted 
+    average of the gradients on the surrounding triangles
+    """
+
+    tri = mesh.tri.simplices
+    x = mesh.tri.points[tri, 0]
+    y = mesh.tri.points[tri, 1]
+
+    b = np.roll(y, -1, axis=1) - np.roll(y, 1, axis=1)
+    c = np.roll(x,  1, axis=1) - np.roll(x, -1, axis=1)
+    area2 = b[:,0]*c[:,1] - b[:,1]*c[:,0]
+    area  = 0.5 * np.abs(area2)
+
+    rows = np.repeat(tri, 3, axis=1).ravel()
+    cols = np.tile(tri, (1,3)).ravel()
+    node_area = np.bincount(tri.ravel(), weights=np.repeat(area, 3), minlength=mesh.npoints)
+    scale = sparse.diags(1.0 / node_area)
+
+    operators = []
+    for coeff in (b, c):
+        values = np.repeat((coeff * (area / area2)[:,None])[:,None,:], 3, axis=1).ravel()
+        D = sparse.coo_matrix((values, (rows, cols)), shape=(mesh.npoints, mesh.npoints)).tocsr()
+        operators.append(scale * D)
+
+    return operators
+
+Dx, Dy = gradient_operators(mesh)
+div_grad = Dx * Dx + Dy * Dy
+
+# +
+from time import time
+
+fields = np.column_stack([height.data, scaled_height.evaluate(mesh), rainfall.evaluate(mesh)])
+
+t = time()
+for i in range(0, 10):
+    dfdx = Dx.dot(fields)
+    dfdy = Dy.dot(fields)
+print("Sparse operators  - 3 fields x 10 : {:.4f}s".format(time() - t))
+
+t = time()
+for i in range(0, 10):
+    for f in (height, scaled_height, rainfall):
+        fgradx, fgrady = fn.math.grad(f)
+        fgradx.evaluate(mesh)
+        fgrady.evaluate(mesh)
+print("fn.math.grad      - 3 fields x 10 : {:.4f}s".format(time() - t))
+
+interior = mesh.bmask
+print("dhdX (error) = ", np.abs(dfdx[interior,0] - np.cos(mesh.coords[interior,0])).max())
+print("dhdY (error) = ", np.abs(dfdy[interior,0]).max())
+print("Div.Grad(h) + h (error) = ", np.abs(div_grad.dot(height.data) + height.data)[interior].mean())
+# -
+
 # ### Level set functions for conditional behaviour
 #
 # We provide `quagmire.function.misc.levelset` to produce simple mask functions that can be used to create conditionals. 
@@ -137,12 +137,50 @@ outflows = mo1[i]
 # $$
 #
 # where $\alpha = 0.5$.
+#
+# Every assignment to `mesh.downhill_neighbours` assembles a new downhill matrix. When comparing different numbers of pathways on the same topography it is worth keeping the matrices that have already been built and switching between them. The matrices are large (and denser for more pathways) so we keep only the few most recently used. The cache is held separately for each mesh. It is only valid for the topography the matrices were built from, so it keeps a copy of that topography and is emptied when the topography has changed.
+#
+# A cache hit restores the downhill matrix (`mesh.downhillMat`) and the downhill neighbour arrays (`mesh.down_neighbour`) that go with it. It also sets the number of pathways the mesh reports, without going through `mesh.downhill_neighbours` (assigning that rebuilds the matrix). A later `deform_topography` therefore rebuilds with the number of pathways that is actually in use.
+
+# +
+from collections import OrderedDict
+from copy import deepcopy
+from weakref import WeakKeyDictionary
+
+downhill_matrix_cache = WeakKeyDictionary()
+
+def set_downhill_neighbours(mesh, n, max_cached=4):
+    """
+    Switch the mesh to n downhill neighbours, re-using the downhill matrix
+    from an earlier call on the same mesh and topography if it has been cached.
+    """
+
+    cache = downhill_matrix_cache.setdefault(mesh, {"topography": None, "matrices": OrderedDict()})
+    matrices = cache["matrices"]
+
+    if cache["topography"] is None or not np.array_equal(cache["topography"], mesh.topography.data):
+        cache["topography"] = mesh.topography.data.copy()
+        matrices.clear()
+
+    if n in matrices:
+        matrices.move_to_end(n)
+        mesh.downhillMat, mesh.down_neighbour = matrices[n]
+        # assigning mesh.downhill_neighbours would rebuild the matrix
+        mesh._downhill_neighbours = n
+        return
+
+    mesh.downhill_neighbours = n
+    matrices[n] = (mesh.downhillMat.copy(), deepcopy(mesh.down_neighbour))
+
+    if len(matrices) > max_cached:
+        matrices.popitem(last=False)
+
 
 # +
 flowpaths = mesh.upstream_integral_fn(rainfall_fn)
 
 print("--- 2 downhill neighbours ---")
-mesh.downhill_neighbours = 2
+set_downhill_neighbours(mesh, 2)
 # mesh.update_height(height)
 
 mo2 = mesh.identify_outflow_points()
@@ -153,7 +191,7 @@ outflow2   = flowpaths2[mo2]
 # sqrtpaths = np.sqrt(flowpaths)
 
 print("--- 3 downhill neighbour ---")
-mesh.downhill_neighbours = 3
+set_downhill_neighbours(mesh, 3)
 # mesh.update_height(height)
 
 mo3 = mesh.identify_outflow_points()
@@ -164,7 +202,7 @@ outflow3   = flowpaths3[mo3]
 # sqrtpaths3 = np.sqrt(flowpaths3)
 
 print("--- 1 downhill neighbour---")
-mesh.downhill_neighbours = 1
+set_downhill_neighbours(mesh, 1)
 # mesh.update_height(height)
 
 mo1 = mesh.identify_outflow_points()
@@ -232,6 +270,7 @@ max_downhill_neighbours = 10
 for n in range(2, max_downhill_neighbours):
     flowpaths_old = flowpaths.copy()
     
+    # always assemble here (not from the cache) so that the matrix statistics are comparable
     mesh.downhill_neighbours = n
     # mesh.update_height(height)
     downhillMat_info = mesh.downhillMat.getInfo()
@@ -254,6 +293,18 @@ ax2.set_title('max difference in stream power')
 plt.show()
 # -
 
+# The first time a number of pathways is requested the matrix is assembled and stored. Returning to a number of pathways that is still in the cache only costs the flow accumulation
+
+# +
+from time import time
+
+for n in (8, 9, 8, 9):
+    t = time()
+    set_downhill_neighbours(mesh, n)
+    flowpaths = flowpaths_fn.evaluate(mesh)
+    print("{} downhill neighbours - {:.3f}s".format(n, time()-t))
+# -
+
 # ## Dense downhill matrices
 #
 # The cumulative flow routine can (potentially) be sped up by multiplying the downhill matrix $\mathbf{D}$ by itself, which increases the number of nodes a parcel of information is moved to its downhill neighbours.
@@ -298,6 +349,173 @@ ax2.set_title('number of cumulative flow iterations')
 plt.show()
 # -
 
+# ## Single-pass accumulation in topological order
+#
+# Each cumulative flow iteration moves information one more node downstream, so the number of iterations grows with the length of the longest flow path. Information only ever moves downhill, which means that sorting the nodes from highest to lowest gives a topological ordering of the downhill graph. In that ordering $\mathbf{I} - \mathbf{D}$ is lower triangular and the upstream integral
+#
+# $$
+# \left( \mathbf{I} - \mathbf{D} \right) \mathbf{q} = \mathbf{r}
+# $$
+#
+# can be obtained with a single forward substitution: one pass over the matrix irrespective of the path lengths. The ordering only changes when the topography does, so it can be computed once and re-used for any number of fields.
+#
+# This is a local operation. In parallel, paths that cross the decomposition still need the iterative matrix approach to carry information through the shadow zones, so the iterative version remains the general-purpose (and default) solver.
+#
+# _Note:_ this requires `scipy >= 1.12`. Earlier versions of `spsolve_triangular` loop over the rows of the matrix in python and the "single pass" is then much slower than the iterative approach.
+
+# +
+from scipy import sparse
+from scipy.sparse.linalg import spsolve_triangular
+
+def downhill_matrix_in_topological_order(mesh):
+    """
+    Returns the downhill matrix (as a scipy sparse matrix) with rows and columns
+    sorted from the highest to the lowest node, along with the sort order.
+    Returns None for the matrix if the downhill graph is not consistent with that
+    order (e.g. flat regions), in which case the iterative approach should be used.
+    """
+
+    indptr, indices, data = mesh.downhillMat.getValuesCSR()
+    D = sparse.csr_matrix((data, indices, indptr), shape=(mesh.npoints, mesh.npoints))
+    D.setdiag(0.0)
+    D.eliminate_zeros()
+
+    order = np.argsort(-mesh.topography.data, kind="stable")
+    D_ordered = D[order][:, order].tocsr()
+
+    if sparse.triu(D_ordered, k=1).nnz != 0:
+        return None, order
+
+    return D_ordered, order
+
+
+def upstream_integral_topological(mesh, values, D_ordered=None, order=None):
+    """
+    Upstream integral of the nodal values (already multiplied by the nodal area) 
+    in a single pass. The ordered matrix can be supplied if it has already been built.
+    values may also be an (npoints, K) array, in which case all K fields are integrated together.
+    """
+
+    if order is None:
+        D_ordered, order = downhill_matrix_in_topological_order(mesh)
+
+    if D_ordered is None:
+        if values.ndim == 2:
+            return np.column_stack([mesh.cumulative_flow(v) for v in values.T])
+        return mesh.cumulative_flow(values)
+
+    L = sparse.identity(mesh.npoints, format="csr") - D_ordered
+    q = spsolve_triangular(L, values[order], lower=True, unit_diagonal=True)
+
+    cumulative = np.empty_like(q)
+    cumulative[order] = q
+
+    return cumulative
+
+
+# +
+from time import time
+
+# restore the original (sparse) downhill matrix 
+mesh.downhillMat = D1
+
+t = time()
+niter, flowpaths_it = mesh._cumulative_flow_verbose(mesh.area*rainfall)
+print("Iterative:   {} iterations, {:.3f}s".format(niter, time()-t))
+
+t = time()
+D_ordered, order = downhill_matrix_in_topological_order(mesh)
+print("Ordering:    {:.3f}s".format(time()-t))
+
+t = time()
+flowpaths_topo = upstream_integral_topological(mesh, mesh.area*rainfall, D_ordered, order)
+print("Single pass: {:.3f}s".format(time()-t))
+
+print("Max difference: {}".format(np.abs(flowpaths_topo - flowpaths_it).max()))
+# -
+
+# It is common to need the upstream integrals of several different fields on the same topography (e.g. rainfall, the topography itself and a mask to obtain catchment areas). These can be stacked as the columns of a single array and integrated together, so the graph is only traversed once for all of them.
+
+# +
+fields = np.column_stack([rainfall, mesh.topography.data, np.where(mesh.topography.data > 0.0, 1.0, 0.0)])
+fields *= mesh.area.reshape(-1,1)
+
+t = time()
+flowpaths_each = np.column_stack([upstream_integral_topological(mesh, f, D_ordered, order) for f in fields.T])
+print("One field at a time: {:.3f}s".format(time()-t))
+
+t = time()
+flowpaths_block = upstream_integral_topological(mesh, fields, D_ordered, order)
+print("All fields at once:  {:.3f}s".format(time()-t))
+
+print("Max difference: {}".format(np.abs(flowpaths_block - flowpaths_each).max()))
+# -
+
+# ### Partitioned accumulation
+#
+# In parallel, each iteration of the cumulative flow algorithm is followed by an exchange of the shadow zones, so the number of global synchronisations is the number of iterations: the length of the longest flow path. An alternative is to complete the accumulation *within* each partition first (a local single-pass solve, as above) and only then exchange the fluxes that leave each partition. These are added to the right hand side of the receiving partition and the local solves are repeated. The number of exchanges is then set by the number of times a flow path crosses from one partition to another, which is usually far smaller than its length.
+#
+# Splitting the downhill matrix into the part that stays within a partition and the part that crosses between partitions, $\mathbf{D} = \mathbf{D}_{in} + \mathbf{D}_{out}$, each outer iteration is
+#
+# $$
+# \left( \mathbf{I} - \mathbf{D}_{in} \right) \mathbf{q}^{k+1} = \mathbf{r} + \mathbf{D}_{out} \mathbf{q}^{k}
+# $$
+#
+# Here we demonstrate this in serial by assigning the nodes to vertical strips and counting the outer iterations that would each need one exchange.
+#
+# The local solves use `spsolve_triangular` and have the same `scipy >= 1.12` requirement as the single pass above.
+
+# +
+def upstream_integral_partitioned(mesh, values, partition, tolerance=1.0e-12, max_its=1000):
+    """
+    Upstream integral computed by single-pass solves within each partition,
+    iterating on the fluxes that cross between partitions. Returns the integral and
+    the number of outer iterations (i.e. exchanges that would be needed in parallel).
+    """
+
+    indptr, indices, data = mesh.downhillMat.getValuesCSR()
+    D = sparse.csr_matrix((data, indices, indptr), shape=(mesh.npoints, mesh.npoints))
+    D.setdiag(0.0)
+    D.eliminate_zeros()
+    D = D.tocoo()
+
+    local = partition[D.row] == partition[D.col]
+    D_in  = sparse.csr_matrix((D.data[local],  (D.row[local],  D.col[local])),  shape=D.shape)
+    D_out = sparse.csr_matrix((D.data[~local], (D.row[~local], D.col[~local])), shape=D.shape)
+
+    # sorted by partition and then by height, the local problems are all lower triangular
+    order = np.lexsort((-mesh.topography.data, partition))
+    L = (sparse.identity(mesh.npoints, format="csr") - D_in)[order][:, order].tocsr()
+
+    if sparse.triu(L, k=1).nnz != 0:
+        return mesh.cumulative_flow(values), None
+
+    q = np.zeros_like(values)
+    q_new = np.empty_like(values)
+
+    for its in range(1, max_its+1):
+        q_new[order] = spsolve_triangular(L, (values + D_out.dot(q))[order], lower=True, unit_diagonal=True)
+        converged = np.abs(q_new - q).max() <= tolerance * np.abs(q_new).max()
+        q[:] = q_new
+        if converged:
+            break
+
+    return q, its
+
+
+# +
+print("Iterative: {} iterations".format(niter))
+
+for nparts in (1, 2, 4, 8, 16):
+    partition = np.minimum((nparts * (x - x.min()) / (x.max() - x.min())).astype(int), nparts-1)
+
+    t = time()
+    flowpaths_part, outer_its = upstream_integral_partitioned(mesh, mesh.area*rainfall, partition)
+
+    print("{:2d} partitions: {} outer iterations, {:.3f}s, max difference {}".format(
+           nparts, outer_its, time()-t, np.abs(flowpaths_part - flowpaths_it).max()))
+# -
+
 # ---
 #
 # [Ex5-PreprocessingSurfaces](Ex5-PreprocessingSurfaces.ipynb)
@@ -192,13 +192,37 @@ lv.control.show()
 # This routine returns the mesh data (for this processor) of a globally synchronised map of the information propagated from the selected points. 
 #
 # The routine is used in the computation of flood fills for the swamp algorithm and should be polished up a bit (sorry).
+#
+# `uphill_propagation` moves the information one node uphill per iteration so it needs as many iterations as there are nodes along the longest flow path. With a single downhill neighbour, every node has exactly one receiver and the receivers form a tree rooted at the outflow points. Following the receivers with _pointer jumping_ (replacing each node's receiver by its receiver's receiver) doubles the distance covered at each pass, so every node finds its outflow point in $O(\log L)$ vectorised passes for a path length $L$. This is done on the local mesh, so it is the serial replacement for `uphill_propagation`.
 
 # +
 ## Unique catchments requires the downhill matrix with downhill_neighbours=1
 
-mesh1s.near_neighbours=1
+mesh1s.downhill_neighbours = 1
 # mesh1s.update_height(mesh1s.heightVariable.data)
 
+
+# +
+def label_catchments(mesh, outflows, outflow_ids, fill=-999999):
+    """
+    Label every node with the id of the outflow point that it drains to
+    (requires downhill_neighbours=1). Nodes that drain to a point that
+    is not in the outflows list are given the fill value.
+    """
+
+    receiver = mesh.down_neighbour[1].copy()
+
+    while True:
+        next_receiver = receiver[receiver]
+        if np.array_equal(next_receiver, receiver):
+            break
+        receiver = next_receiver
+
+    ids = np.full(mesh.npoints, fill, dtype=int)
+    ids[outflows] = outflow_ids
+
+    return ids[receiver]
+
 # +
 ## Need a unique ID that works in parallel ... global node number would work but 
 ## not that easy to map to colours in lavavu 
@@ -210,7 +234,13 @@ outflowID = mesh1s.lgmap_row.apply(outflows.astype(PETSc.IntType))
 # But on 1 proc, this is easier / better:
 
 outflowID = np.array(range(0, outflows.shape[0]))
-ctmt = mesh1s.uphill_propagation(outflows,  outflowID, its=99999, fill=-999999).astype(np.int)
+ctmt = label_catchments(mesh1s, outflows, outflowID, fill=-999999)
+
+# In parallel, the catchment ids need to propagate through the shadow zones:
+# ctmt = mesh1s.uphill_propagation(outflows,  outflowID, its=99999, fill=-999999).astype(np.int)
+
+catchments = mesh1s.add_variable(name="catchments")
+catchments.data = ctmt
 # -
 
 
@@ -260,5 +290,49 @@ lv.control.ObjectList()
 
 lv.control.show()
 # -
+# ## Catchment-aware partitioning
+#
+# When the mesh is distributed, the partitioning only knows about the mesh connectivity. A large river system can be split across many processors and then every upstream integral or uphill propagation on that catchment has to pass information back and forth through the shadow zones. If we know the catchments, we can instead try to keep each one on a single processor and balance the load by assigning whole catchments (largest first) to whichever processor currently has the fewest nodes.
+#
+# Here we compare that with a simple geometric partition (strips with equal numbers of nodes) by counting the catchments that are split between partitions and the number of downhill connections that cross a partition boundary (each of which requires communication). This is a diagnostic only - the partition is not passed back to the DM.
+
+# +
+import heapq
+
+nparts = 4
+receiver = mesh1s.down_neighbour[1]
+
+# nodes that do not drain to one of the outflow points are treated individually
+labels = np.where(ctmt >= 0, ctmt, ctmt.max() + 1 + np.arange(mesh1s.npoints))
+catchment_ids, catchment_index, catchment_size = np.unique(labels, return_inverse=True, return_counts=True)
+
+## geometric partition
+geometric_partition = np.empty(mesh1s.npoints, dtype=int)
+geometric_partition[np.argsort(x, kind="stable")] = np.arange(mesh1s.npoints) * nparts // mesh1s.npoints
+
+## whole catchments, largest first, to the least loaded partition
+load = [(0, rank) for rank in range(0, nparts)]
+catchment_rank = np.empty(catchment_ids.shape[0], dtype=int)
+
+for c in np.argsort(-catchment_size, kind="stable"):
+    nodes, rank = heapq.heappop(load)
+    catchment_rank[c] = rank
+    heapq.heappush(load, (nodes + catchment_size[c], rank))
+
+catchment_partition = catchment_rank[catchment_index]
+
+
+def partition_stats(partition):
+    nodes = np.bincount(partition, minlength=nparts)
+    spans = np.bincount(np.unique(np.column_stack([catchment_index, partition]), axis=0)[:,0])
+    split = np.count_nonzero(spans > 1)
+    cut = np.count_nonzero(partition != partition[receiver])
+    return nodes, nodes.max() / nodes.mean(), split, cut
+
+
+for name, partition in [("geometric", geometric_partition), ("catchment", catchment_partition)]:
+    print("{:10s} | nodes {} | imbalance {:.3f} | catchments split {} | downhill edges cut {}".format(
+            name, *partition_stats(partition)))
+# -
 
 
@@ -201,13 +201,18 @@ lv.control.show()
 #
 # It would also be straightforward to add points close to the boundary to improve the resolution at the interface. Stripy does not offer contrained triangulations at this stage so we are not able to mesh the boundary itself.
 #
+# The diffusivity is a composite of eight pointwise operations and every one of them produces a full-size array each time the solver evaluates it (i.e. on every timestep). None of its inputs change during the integration, so we evaluate the expression once and hand the solver a mesh variable holding the result. The function `kappa1` is still available if the parameters need to be changed (in which case the variable should be re-evaluated).
+#
 
 # +
 kappa1 = fn.parameter(1.0) + fn. parameter(99.0) * fn.misc.levelset(
                                  (fn.misc.coord(0) - fn.parameter(0.5))**2 + 
                                  (fn.misc.coord(1) - fn.parameter(0.5))**2, 0.04)
 
-diffusion_solver.diffusivity = kappa1
+kappa1_var = mesh.add_variable(name="kappa1")
+kappa1_var.data = kappa1.evaluate(mesh)
+
+diffusion_solver.diffusivity = kappa1_var
 diff_timestep = diffusion_solver.diffusion_timestep()
 
 time0 = 0.0
@@ -285,15 +290,46 @@ tri1.control.List(options=
                   property="colourby", value="kappa", command="redraw")
 lv.control.show()
 
+# -
+
+
 
+# ## Mesh refinement
+#
+# Add a bunch of mesh points at the (known) interface location. Rather than refining the whole mesh (each level quadruples the number of points everywhere), we add the midpoints of the edges of only those triangles over which an indicator varies by more than some threshold - here the diffusivity itself, so that only the triangles that straddle the jump are refined. The new points are triangulated into a new mesh and existing fields are transferred by interpolation. Any other function could be used as the indicator (e.g. the temperature gradient or the flux).
 
 # +
-## Mesh refinement
-##
-## Add a bunch of mesh points at the (known) interface location
+def refine_where(mesh, indicator, threshold):
+    """
+    Points for a new mesh with the midpoints added to every edge of the triangles
+    over which the indicator (nodal values) varies by more than threshold.
+    Returns x, y, bmask
+    """
+
+    tri = mesh.tri.simplices
+    variation = indicator[tri].max(axis=1) - indicator[tri].min(axis=1)
+    marked = tri[variation > threshold]
+
+    edges = np.vstack([marked[:,[0,1]], marked[:,[1,2]], marked[:,[2,0]]])
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    midpoints = 0.5 * (mesh.coords[edges[:,0]] + mesh.coords[edges[:,1]])
+
+    points = np.vstack([mesh.coords, midpoints])
+    bmask  = np.hstack([mesh.bmask, mesh.bmask[edges[:,0]] | mesh.bmask[edges[:,1]]])
+
+    return points[:,0], points[:,1], bmask
 
 
+mesh_r = mesh
+for level in range(0, 2):
+    xr, yr, bmask_r = refine_where(mesh_r, kappa1.evaluate(mesh_r), 1.0)
+    DM_r = meshtools.create_DMPlex_from_points(xr, yr, bmask=bmask_r)
+    mesh_r = QuagMesh(DM_r, verbose=False, tree=True)
 
+temperature_r = mesh_r.add_variable(name="T_refined")
+temperature_r.data = temperature.evaluate(mesh_r.coords[:,0], mesh_r.coords[:,1])
+
+print("Refined mesh: {} points (two levels of uniform refinement: ~{} points)".format(mesh_r.npoints, 16*mesh.npoints))
 
 # +
 temperature.data = (fn.parameter(1.0) - fn.misc.coord(1)).evaluate(mesh)
@@ -342,6 +378,77 @@ lv.control.show()
 
 
 
+# -
+
+# ## Implicit (backward Euler) timestepping
+#
+# The explicit timestep is controlled by the largest diffusivity on the smallest element, so the inclusion forces every step to be 100 times smaller than it would be for the background. Since the diffusivity does not change during the integration, we can assemble the linear finite element diffusion operator once, combine it with the (lumped) mass matrix and the timestep,
+#
+# $$ \left( M + \Delta t K \right) T^{n+1} = M T^n , $$
+#
+# and factorise it once. Each step is then a single pair of triangular solves and the timestep is chosen for accuracy rather than stability. The Dirichlet rows of the matrix are replaced by the identity so the boundary temperatures are held fixed and the natural boundary condition of the finite element operator gives zero flux on the vertical sides, as in the explicit solver.
+#
+# This is a serial (`scipy`) demonstration - in parallel the same matrix would be assembled into PETSc and solved with a KSP.
+
+# +
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+def assemble_diffusion_operator(mesh, kappa):
+    """
+    Linear finite element stiffness matrix for diffusivity kappa (averaged on each triangle)
+    and the lumped mass (area associated with each node)
+    """
+
+    tri = mesh.tri.simplices
+    x = mesh.tri.points[tri, 0]
+    y = mesh.tri.points[tri, 1]
+
+    # gradients of the linear shape functions are (b, c) / 2A on each triangle
+    b = np.roll(y, -1, axis=1) - np.roll(y, 1, axis=1)
+    c = np.roll(x,  1, axis=1) - np.roll(x, -1, axis=1)
+    area = 0.5 * np.abs(b[:,0]*c[:,1] - b[:,1]*c[:,0])
+
+    kappa_e = kappa[tri].mean(axis=1)
+    Ke = (b[:,:,None]*b[:,None,:] + c[:,:,None]*c[:,None,:]) * (kappa_e / (4.0*area))[:,None,None]
+
+    rows = np.repeat(tri, 3, axis=1).ravel()
+    cols = np.tile(tri, (1,3)).ravel()
+    K = sparse.coo_matrix((Ke.ravel(), (rows, cols)), shape=(mesh.npoints, mesh.npoints)).tocsr()
+
+    mass = np.bincount(tri.ravel(), weights=np.repeat(area/3.0, 3), minlength=mesh.npoints)
+
+    return K, mass
+
+
+implicit_dt = 0.0005
+
+K, mass = assemble_diffusion_operator(mesh, kappa1_var.data)
+fixed = dirichlet_mask.evaluate(mesh) > 0.5
+
+A = sparse.diags((~fixed).astype(float)) * (sparse.diags(mass) + implicit_dt * K) + sparse.diags(fixed.astype(float))
+implicit_solver = splu(A.tocsc())
+
+def backward_euler_integration(phi, Delta_t):
+    steps = int(round(Delta_t / implicit_dt))
+    for step in range(0, steps):
+        phi = implicit_solver.solve(np.where(fixed, phi, mass * phi))
+    return phi
+
+print("Implicit timestep = {} ({} x the explicit limit)".format(implicit_dt, implicit_dt / diff_timestep))
+
+# +
+T_implicit = (fn.parameter(1.0) - fn.misc.coord(1)).evaluate(mesh)
+
+T_implicit = backward_euler_integration(T_implicit, 0.001)
+T_implicit = backward_euler_integration(T_implicit, 0.004)
+T_implicit = backward_euler_integration(T_implicit, 0.005)
+
+temp01_implicit = mesh.add_variable(name="T01_implicit")
+temp01_implicit.data = T_implicit
+
+print("Max difference from the explicit solution at t=0.01 - {}".format(np.abs(temp01_implicit.data - temp01.data).max()))
+
 # + slideshow={"slide_type": "skip"} active=""
 # def diffusion_time_integration(timestep, 
 #                                phi, 
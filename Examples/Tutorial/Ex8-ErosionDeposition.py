@@ -193,6 +193,29 @@ erosion_rate = efficiency*stream_power_fn
 deposition_rate = mesh.upstream_integral_fn(erosion_rate_fn)/(alpha*stream_power_fn)
 
 dHdt_fn3 = deposition_rate - erosion_rate
+# -
+
+# ### Evaluating the rate laws efficiently
+#
+# All three laws are built from the stream power and the upstream integral of the erosion rate, and each of those contains an upstream integral (the most expensive operation in the graph). Because the functions are lazy, evaluating `dHdt_fn1`, `dHdt_fn2` and `dHdt_fn3` one after the other recomputes these terms every time - ten upstream integrals in total for three fields that only need two.
+#
+# When the topography is not changing, the expensive terms can be evaluated once and stored in mesh variables. The efficiency is a constant multiplier, so the upstream integral of the erosion rate is simply the efficiency times the upstream integral of the stream power. We store the stream power and its upstream integral (without the efficiency) and re-assemble the laws from those variables so that only the cheap, pointwise operations (and the parameters `length_scale`, `alpha`, `efficiency`) remain live.
+#
+# Be aware that the stored values are a snapshot: they need to be re-evaluated whenever the topography, the rainfall or any parameter inside them (`K`, `m`, `n`) changes.
+
+# +
+stream_power_cache = mesh.add_variable(name="stream_power")
+stream_power_cache.data = stream_power_fn.evaluate(mesh)
+
+upstream_stream_power_cache = mesh.add_variable(name="upstream_stream_power")
+upstream_stream_power_cache.data = mesh.upstream_integral_fn(stream_power_cache).evaluate(mesh)
+
+erosion_rate_cached_fn = efficiency*stream_power_cache
+deposition_rate_cached_fn = efficiency*upstream_stream_power_cache
+
+dHdt_cached_fn1 = deposition_rate_cached_fn - erosion_rate_cached_fn
+dHdt_cached_fn2 = (deposition_rate_cached_fn - erosion_rate_cached_fn)/length_scale
+dHdt_cached_fn3 = deposition_rate_cached_fn/(alpha*stream_power_cache) - erosion_rate_cached_fn
 
 # +
 import lavavu
@@ -207,9 +230,9 @@ tri1 = lv.triangles("triangles", wireframe=False)
 tri1.vertices(verts)
 tri1.indices(mesh.tri.simplices)
 
-tri1.values(dHdt_fn1.evaluate(mesh), "EroDep1")
-tri1.values(dHdt_fn2.evaluate(mesh), "EroDep2")
-tri1.values(dHdt_fn3.evaluate(mesh), "EroDep3")
+tri1.values(dHdt_cached_fn1.evaluate(mesh), "EroDep1")
+tri1.values(dHdt_cached_fn2.evaluate(mesh), "EroDep2")
+tri1.values(dHdt_cached_fn3.evaluate(mesh), "EroDep3")
 
 #Create colour bar then load a colourmap into it
 tri1.colourmap([(0, 'blue'), (0.2, 'white'), (1, 'orange')], reverse=True)
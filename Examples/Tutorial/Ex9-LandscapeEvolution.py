@@ -140,6 +140,45 @@ lv = lavavu.Viewer(border=False, background="#FFFFFF", resolution=[1000,600], ne
 tri1 = lv.triangles("triangles", wireframe=False)
 tri1.vertices(verts)
 tri1.indices(mesh.tri.simplices)
+# -
+
+# Writing the fields to disk blocks the timestepping loop. A background thread does not help here because `petsc4py` holds the python interpreter lock for the whole of the HDF5 write. Instead, the writes are handed to a separate process: each step puts a copy of the topography on a queue, and the writer process appends it to the HDF5 file (with `h5py`) while the next step is computed. The queue only holds a couple of snapshots. If the file system is slower than the model, the loop waits when the queue is full, so snapshots do not pile up in memory.
+#
+# The writer process only uses `h5py` and `numpy` and never touches PETSc. It is started with `fork`, so this is for Linux / macOS, and even there forking after `petsc4py` has initialised MPI is not supported by every MPI implementation (Open MPI, for example, warns about it and the child can corrupt the parent's communication state). Set `async_io = False` if your MPI stack objects. If the writer fails, its traceback is printed to the child's stderr. The loop notices because it only waits on the queue for a short time before checking that the writer is still alive, and an error is raised if the writer exits unsuccessfully. The mesh and the initial topography are written by quagmire before the writer is started, and the new datasets copy the layout of that first field. The writer is only used in serial (`async_io`), where the local and global node orderings are the same. In parallel the HDF5 writes are collective and the loop falls back to `save_field_to_hdf5`.
+#
+# The time the loop spends on output is reported at the end so that the two approaches can be compared (set `async_io = False`).
+
+# +
+import multiprocessing
+from petsc4py import PETSc
+
+def hdf5_field_writer(filename, template, queue):
+    import h5py
+
+    with h5py.File(filename, mode="a") as h5:
+        shape = h5["fields"][template].shape
+
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+
+            name, data = item
+            h5["fields"].create_dataset(name, data=data.reshape(shape))
+
+def put_field(queue, writer, item, timeout=1.0):
+    from queue import Full
+
+    while True:
+        if not writer.is_alive():
+            raise RuntimeError("HDF5 field writer has stopped (exit code {})".format(writer.exitcode))
+        try:
+            queue.put(item, timeout=timeout)
+            return
+        except Full:
+            pass
+
+async_io = PETSc.COMM_WORLD.size == 1
 
 # +
 save_fields = False
@@ -152,16 +191,33 @@ mesh.verbose = False
 with mesh.deform_topography():
     mesh.topography.data = height.copy()
     
-h5_filename = "fields_{:06d}.h5"
+h5_filename = "fields.h5"
 stats = "Step {:04d} | dt {:.5f} | time {:.4f} | min/mean/max height {:.3f}/{:.3f}/{:.3f} | step walltime {:.3f}"
 sim_time = 0.0
 steps = 50
 
+# the mesh geometry does not change - write it once and append a field for each step
+if save_fields:
+    mesh.save_mesh_to_hdf5(h5_filename)
+    mesh.save_field_to_hdf5(h5_filename, topo_initial=mesh.topography.data)
+
+if save_fields and async_io:
+    context = multiprocessing.get_context("fork")
+    field_queue = context.Queue(maxsize=2)
+    field_writer = context.Process(target=hdf5_field_writer, args=(h5_filename, "topo_initial", field_queue))
+    field_writer.start()
+
+output_time = 0.0
+
+
+# work arrays for the timestepping are allocated once, outside the loop
+topography0 = np.empty_like(mesh.topography.data)
+topography1 = np.empty_like(mesh.topography.data)
 
 for i in range(0, steps):
     t = time()
     
-    topography0 = mesh.topography.copy()
+    topography0[:] = mesh.topography.data
     
     # get timestep size
     dt = min(diffusion_solver.diffusion_timestep(), transport_solver.erosion_deposition_timestep())
@@ -172,8 +228,10 @@ for i in range(0, steps):
     dhdt = diffusion_rate - erosion_rate #+ deposition_rate
     
     # do not rebuilt downhill matrix at half timestep
+    np.multiply(dhdt, 0.5*dt, out=topography1)
+    topography1 += topography0
     mesh.topography.unlock()
-    mesh.topography.data = mesh.topography.data + 0.5*dt*dhdt
+    mesh.topography.data = topography1
     mesh.topography.lock()
     
     
@@ -186,18 +244,23 @@ for i in range(0, steps):
     dhdt = diffusion_rate - erosion_rate #+ deposition_rate
     
     # now take full timestep
+    np.multiply(dhdt, dt, out=topography1)
+    topography1 += topography0
     with mesh.deform_topography():
-        mesh.topography.data = topography0.data + dt*dhdt
+        mesh.topography.data = topography1
     
     # deal with local minima
 #     mesh.low_points_local_patch_fill()
     
     
     # save fields
-    if save_fields:
-        mesh.save_mesh_to_hdf5(h5_filename.format(i))
-        mesh.save_field_to_hdf5(h5_filename.format(i), topo=mesh.topography.data)
-        # quagmire.tools.generate_xdmf(h5_filename.format(i))
+    t_output = time()
+    if save_fields and async_io:
+        put_field(field_queue, field_writer, ("topo_{:06d}".format(i), mesh.topography.data.copy()))
+
+    elif save_fields:
+        mesh.save_field_to_hdf5(h5_filename, **{"topo_{:06d}".format(i): mesh.topography.data})
+    output_time += time() - t_output
     
     if plot_lavavu:
         lv.addstep(i)
@@ -215,6 +278,19 @@ for i in range(0, steps):
         print(stats.format(i, dt, sim_time, mesh.topography.min(), mesh.topography.data.mean(),
                            mesh.topography.max(), time() - t))
 
+if save_fields and async_io:
+    t_output = time()
+    put_field(field_queue, field_writer, None)
+    field_writer.join()
+    output_time += time() - t_output
+
+    if field_writer.exitcode != 0:
+        raise RuntimeError("HDF5 field writer failed (exit code {})".format(field_writer.exitcode))
+
+if save_fields:
+    quagmire.tools.generate_xdmf(h5_filename)
+    print("Time spent on output in the timestepping loop: {:.3f}s (async_io = {})".format(output_time, async_io))
+
 # +
 # change in topography
 
@@ -259,3 +335,122 @@ plt.show()
 
 
 
+
+# ## Adaptive timestepping
+#
+# The loop above takes the global minimum of the diffusion and erosion / deposition timestep limits at every step. These are worst-case stability estimates and usually far more restrictive than is needed for an accurate solution. An alternative is to let the solution decide: an Euler step and a second order (Heun) step share the same first rate evaluation, and the difference between them is an estimate of the error in the Euler step. A step is accepted if this is below a tolerance (and the second order update is used) and the next timestep is scaled up or down according to how close we came to the tolerance.
+#
+# Each attempted step costs one rate evaluation plus one more after an accepted step (where the downhill matrix has been rebuilt for the new topography), which is the same as the midpoint scheme above, so the saving is simply the number of steps. The intermediate (Euler) stage does not rebuild the downhill matrix, as in the loop above. The error is the local maximum, so this is written for serial runs.
+
+# +
+def landscape_dhdt():
+    diffusion_rate = diffusion_solver.diffusion_rate_fn(mesh.topography).evaluate(mesh)
+    erosion_rate, deposition_rate = transport_solver.erosion_deposition_local_equilibrium(efficiency)
+    return diffusion_rate - erosion_rate #+ deposition_rate
+
+
+def adaptive_time_integration(end_time, dt, tolerance):
+    """
+    Integrate the topography to end_time using the embedded Euler / Heun pair 
+    with the timestep controlled by the difference between the two estimates
+    """
+
+    elapsed_time = 0.0
+    accepted, rejected = 0, 0
+
+    topography0 = mesh.topography.data.copy()
+    topography1 = np.empty_like(topography0)
+    dhdt0 = landscape_dhdt()
+
+    while elapsed_time < end_time:
+        dt = min(dt, end_time - elapsed_time)
+
+        np.multiply(dhdt0, dt, out=topography1)
+        topography1 += topography0
+        mesh.topography.unlock()
+        mesh.topography.data = topography1
+        mesh.topography.lock()
+
+        dhdt1 = landscape_dhdt()
+        error = 0.5 * dt * np.abs(dhdt1 - dhdt0).max()
+
+        if error <= tolerance:
+            topography1 += 0.5 * dt * (dhdt1 - dhdt0)
+            with mesh.deform_topography():
+                mesh.topography.data = topography1
+
+            topography0[:] = topography1
+            dhdt0 = landscape_dhdt()
+            elapsed_time += dt
+            accepted += 1
+        else:
+            mesh.topography.unlock()
+            mesh.topography.data = topography0
+            mesh.topography.lock()
+            rejected += 1
+
+        dt *= min(2.0, max(0.2, 0.9 * np.sqrt(tolerance / max(error, 1.0e-30))))
+
+    return elapsed_time, accepted, rejected
+
+
+# +
+topography_fixed = mesh.topography.data.copy()
+
+with mesh.deform_topography():
+    mesh.topography.data = height.copy()
+
+dt0 = min(diffusion_solver.diffusion_timestep(), transport_solver.erosion_deposition_timestep())
+tolerance = 1.0e-3 * (height.max() - height.min())
+
+t = time()
+elapsed_time, accepted, rejected = adaptive_time_integration(sim_time, dt0, tolerance)
+
+print("Adaptive: {} accepted / {} rejected steps to time {:.4f} (fixed scheme: {} steps) | walltime {:.3f}".format(
+       accepted, rejected, elapsed_time, steps, time() - t))
+print("Max difference from the fixed timestep solution - {:.5f}".format(np.abs(mesh.topography.data - topography_fixed).max()))
+# -
+
+# ## Where is the timestep limit coming from ?
+#
+# Both of the timestep estimates above are global minima over all nodes. We can look at the local version of the same limits to see how much of the mesh is actually being held back: the diffusion limit at each node is $\Delta x^2 / 2 \kappa$ and the erosion limit is the time for the incision front (the erosion rate divided by the slope) to cross the node. Binning the nodes by the power of two of their local limit relative to the global minimum shows how many could take 2, 4, 8 ... times larger steps.
+#
+# This is the information that a multirate scheme needs - nodes in bin $k$ would be advanced $2^k$ times less often with the fluxes synchronised at the bin boundaries. That is not implemented here, but the distribution tells us whether it would be worth doing for a given landscape.
+
+# +
+area = mesh.area
+kappa = diffusion_solver.diffusivity.evaluate(mesh) * np.ones(mesh.npoints)
+slope = mesh.slope.evaluate(mesh)
+erosion_rate, deposition_rate = transport_solver.erosion_deposition_local_equilibrium(efficiency)
+
+celerity = np.zeros(mesh.npoints)
+np.divide(np.abs(erosion_rate), slope, out=celerity, where=slope > 0.0)
+
+local_dt_diffusion = 0.5 * area / kappa
+local_dt_erosion = np.full(mesh.npoints, np.inf)
+np.divide(np.sqrt(area), celerity, out=local_dt_erosion, where=celerity > 0.0)
+
+local_dt = np.minimum(local_dt_diffusion, local_dt_erosion)
+dt_min = local_dt.min()
+
+max_level = 10
+level = np.clip(np.floor(np.log2(local_dt / dt_min)), 0, max_level).astype(int)
+fraction = np.bincount(level, minlength=max_level+1) / float(mesh.npoints)
+
+print("Global timestep limits (diffusion / erosion) - {:.3e} / {:.3e}".format(diffusion_solver.diffusion_timestep(), 
+                                                                           transport_solver.erosion_deposition_timestep()))
+for k in range(0, max_level+1):
+    print("dt >= {:4d} x dt_min : {:6.2f}% of nodes".format(2**k, 100.0*fraction[k:].sum()))
+
+# +
+fig, (ax1, ax2) = plt.subplots(1,2, figsize=(20,8))
+
+ax1.bar(range(0, max_level+1), 100.0*fraction)
+ax1.set_xlabel("log2 (local dt / dt_min)")
+ax1.set_ylabel("% of nodes")
+
+ax2.axis('equal')
+ax2.axis('off')
+im2 = ax2.tripcolor(x, y, mesh.tri.simplices, level, cmap='viridis')
+fig.colorbar(im2, ax=ax2)
+plt.show()
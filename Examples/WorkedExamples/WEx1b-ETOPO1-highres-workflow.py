@@ -96,20 +96,20 @@ gtiff = gdal.Open("../../data/ETOPO1_Ice_c_geotiff.tif")
 width = gtiff.RasterXSize
 height = gtiff.RasterYSize
 gt = gtiff.GetGeoTransform()
-img = gtiff.GetRasterBand(1).ReadAsArray().T
-
-img = np.fliplr(img)
 
 sliceLeft   = int(180+minX) * 60
 sliceRight  = int(180+maxX) * 60
 sliceBottom = int(90+minY) * 60
 sliceTop    = int(90+maxY) * 60
 
-LandImg = img[ sliceLeft:sliceRight, sliceBottom:sliceTop].T
-LandImg = np.flipud(LandImg)
+## Read only the window we need (rows run north to south in the file)
+## rather than the whole 21600 x 10800 global grid
+
+LandImg = gtiff.GetRasterBand(1).ReadAsArray(sliceLeft, height - sliceTop, 
+                                              sliceRight - sliceLeft, sliceTop - sliceBottom)
 
 # +
-# np.savez_compressed("ETOPO.npz", Description="Etopo1 Numpy Array 21600 x 10800", ETOPO1=img)
+# np.savez_compressed("ETOPO.npz", Description="Etopo1 Numpy Array 21600 x 10800", ETOPO1=gtiff.GetRasterBand(1).ReadAsArray())
 
 
 # -
@@ -250,7 +250,7 @@ plt.savefig("WEx3-Flowpath-1.png", dpi=250)
 #
 # The swamp algorithm is for extensive regions that have only internal drainage. Some changes to the identification of "erroneous" low points is needed for cases where internal drainages are expected.
 #
-# At least one extra round of iteration is often helpful.
+# At least one extra round of iteration is often helpful. The extra round always starts with one swamp fill. After that, each fill rebuilds the downhill matrix for the entire mesh, so we check for remaining low points *before* each swamp fill and skip the rebuild when there is nothing left to do.
 #
 # In this case, the hydrologically enforced DEM should not have any local minima but there are some issues that are associated with water bodies that are dammed and this does, as a result, need a little modification which we compute here and analyse after the fact. 
 
@@ -263,9 +263,11 @@ for repeat in range(0,2):
     low_point_coords2 = mesh.coords[low_points2] 
     print("Low points - {}".format(low_points2.shape))
 
-    for i in range(0,10):
+    if repeat > 0:
         mesh.low_points_swamp_fill(ref_height=-0.01, ref_gradient=0.001)
 
+    for i in range(0,10):
+        # Check before filling: every swamp fill rebuilds the downhill matrix for the whole mesh
         # In parallel, we can't break if ANY processor has work to do (barrier / sync issue)
         low_points3 = mesh.identify_global_low_points()
 
@@ -273,6 +275,8 @@ for repeat in range(0,2):
         if low_points3[0] == 0:
             break
 
+        mesh.low_points_swamp_fill(ref_height=-0.01, ref_gradient=0.001)
+
 
 cumulative_flow_3 = mesh.upstream_integral_fn(mesh.topography**2).evaluate(mesh)
 low_points3 = mesh.identify_low_points()
@@ -41,16 +41,24 @@ import gdal
 # %pylab inline
 
 # +
+## Set restart = True to reload the filled mesh written by a previous run (see the checkpoint below).
+## The DEM is not read at all in that case.
+
+checkpoint_file = "WEx4-Tasmania-filled.h5"
+restart = False
+
 file = "data/dem9s-tassie-quagmire.tif"
-ds = gdal.Open(file)
-band = ds.GetRasterBand(1)
-height = band.ReadAsArray()
-[cols, rows] = height.shape
-
-left, hres, n0, top, n1, vres  = ds.GetGeoTransform()
-right = left+rows*hres
-bottom = top+cols*vres
-x,y = np.meshgrid(np.arange(left, right, hres), np.arange(top,  bottom, vres))
+
+if not restart:
+    ds = gdal.Open(file)
+    band = ds.GetRasterBand(1)
+    height = band.ReadAsArray()
+    [cols, rows] = height.shape
+
+    left, hres, n0, top, n1, vres  = ds.GetGeoTransform()
+    right = left+rows*hres
+    bottom = top+cols*vres
+    x,y = np.meshgrid(np.arange(left, right, hres), np.arange(top,  bottom, vres))
 # -
 
 
@@ -69,48 +77,84 @@ outSpatialRef.ImportFromEPSG(28355) # GDA94 MGA zone 55
 
 transform = osr.CoordinateTransformation(inSpatialRef, outSpatialRef)
 
-transformed_points = transform.TransformPoints(np.c_[x.flat, y.flat])
-transformed_points = np.vstack(transformed_points)
-eastings, northings = transformed_points[:,0], transformed_points[:,1]
+if not restart:
+    transformed_points = transform.TransformPoints(np.c_[x.flat, y.flat])
+    transformed_points = np.vstack(transformed_points)
+    eastings, northings = transformed_points[:,0], transformed_points[:,1]
 
 # +
 from scipy.ndimage.filters import gaussian_filter
 
-point_mask =  height > -0.5
+if not restart:
+    point_mask =  height > -0.5
 
-#corners
-point_mask[0,0] = 1.0
-point_mask[0,-1] = 1.0
-point_mask[-1,0] = 1.0
-point_mask[-1,-1] = 1.0
+    #corners
+    point_mask[0,0] = 1.0
+    point_mask[0,-1] = 1.0
+    point_mask[-1,0] = 1.0
+    point_mask[-1,-1] = 1.0
 
-xs = eastings[point_mask.ravel()]
-ys = northings[point_mask.ravel()]
-heights = height[point_mask]  ## in km 
-points = np.column_stack([xs, ys])
+    xs = eastings[point_mask.ravel()]
+    ys = northings[point_mask.ravel()]
+    heights = height[point_mask]  ## in km 
+    points = np.column_stack([xs, ys])
 
-submarine = (heights.ravel() <  10 )
-subaerial = (heights.ravel() >= 10 )
+    submarine = (heights.ravel() <  10 )
+    subaerial = (heights.ravel() >= 10 )
 # -
 
 
-DM = meshtools.create_DMPlex_from_points(xs, ys, bmask=subaerial)
-mesh = quagmire.QuagMesh(DM, downhill_neighbours=2)
+# +
+if not restart:
+    DM = meshtools.create_DMPlex_from_points(xs, ys, bmask=subaerial)
+    mesh = quagmire.QuagMesh(DM, downhill_neighbours=2)
+
+    with mesh.deform_topography():
+        mesh.topography.data = heights                                                                 
+
+else:
+    import h5py
 
-with mesh.deform_topography():
-    mesh.topography.data = heights                                                                 
+    DM = meshtools.create_DMPlex_from_hdf5(checkpoint_file)
+    mesh = quagmire.QuagMesh(DM, downhill_neighbours=2)
+
+    with h5py.File(checkpoint_file, mode="r") as h5:
+        h5_vertices   = h5["geometry"]["vertices"][()]
+        h5_topography = h5["fields"]["topography"][()].ravel()
+        h5_bmask      = h5["fields"]["bmask"][()].ravel() > 0.5
+        point_mask    = h5["dem"]["point_mask"][()]
+        left, right, bottom, top = h5["dem"]["extent"][()]
+
+    # The plots below index DEM-ordered arrays (xs, ys, point_mask) by mesh node, so the
+    # mesh must come back in the order it was written (i.e. this is a serial restart)
+    assert h5_vertices.shape[0] == mesh.coords.shape[0], "Checkpoint does not match this mesh"
+    assert np.abs(h5_vertices[:,0:2] - mesh.coords).max() < 1.0e-6 * np.ptp(h5_vertices), \
+        "Checkpoint node ordering does not match this mesh"
+
+    xs, ys = mesh.coords[:,0], mesh.coords[:,1]
+
+    mesh.bmask = h5_bmask
+    mesh.mask.unlock()
+    mesh.mask.data = mesh.bmask.astype(np.float)
+    mesh.mask.lock()
+
+    with mesh.deform_topography():
+        mesh.topography.data = h5_topography
 
 # +
-low_points1 = mesh.identify_low_points()
-low_point_coords1 = mesh.coords[low_points1] 
-print(low_points1.shape)
+## These describe the topography before filling and are skipped on restart
+
+if not restart:
+    low_points1 = mesh.identify_low_points()
+    low_point_coords1 = mesh.coords[low_points1] 
+    print(low_points1.shape)
 
-cumulative_flow_1 = mesh.upstream_integral_fn(mesh.topography).evaluate(mesh)
-topography_1 = mesh.topography.data[:]
+    cumulative_flow_1 = mesh.upstream_integral_fn(mesh.topography).evaluate(mesh)
+    topography_1 = mesh.topography.data[:]
 
-outflow_points1 = np.unique(np.hstack(( mesh.identify_outflow_points(), mesh.identify_low_points())))
-upstream_area1  = mesh.upstream_integral_fn(fn.misc.levelset(mesh.topography, 0.0)).evaluate(mesh)
-print(mesh.identify_outflow_points().shape)
+    outflow_points1 = np.unique(np.hstack(( mesh.identify_outflow_points(), mesh.identify_low_points())))
+    upstream_area1  = mesh.upstream_integral_fn(fn.misc.levelset(mesh.topography, 0.0)).evaluate(mesh)
+    print(mesh.identify_outflow_points().shape)
 
 # +
 ## plot the results
@@ -136,29 +180,30 @@ rivers = cfeature.NaturalEarthFeature('physical', 'rivers_lake_centerlines', '10
 
 map_extent = ( left, right, bottom, top)
 
-logflow = np.log10(1.0e-3+upstream_area1)
-flows1 = logflow.min() * np.ones_like(height)
-flows1[point_mask] = logflow
+if not restart:
+    logflow = np.log10(1.0e-3+upstream_area1)
+    flows1 = logflow.min() * np.ones(point_mask.shape)
+    flows1[point_mask] = logflow
 
-plt.figure(figsize=(15, 10))
-ax = plt.subplot(111, projection=ccrs.PlateCarree())
-ax.set_extent(map_extent)
+    plt.figure(figsize=(15, 10))
+    ax = plt.subplot(111, projection=ccrs.PlateCarree())
+    ax.set_extent(map_extent)
 
-# ax.add_feature(coastline, edgecolor="black", linewidth=1, zorder=3)
+    # ax.add_feature(coastline, edgecolor="black", linewidth=1, zorder=3)
 
-ax.add_feature(lakes,     edgecolor="black", facecolor="none", linewidth=1, zorder=3)
-ax.add_feature(rivers   , edgecolor="black", facecolor="none", linewidth=1, zorder=3)
+    ax.add_feature(lakes,     edgecolor="black", facecolor="none", linewidth=1, zorder=3)
+    ax.add_feature(rivers   , edgecolor="black", facecolor="none", linewidth=1, zorder=3)
 
-# ax.scatter(xs[submarine],ys[submarine], color="#000044", s=.1)
+    # ax.scatter(xs[submarine],ys[submarine], color="#000044", s=.1)
 
-plt.imshow(flows1, extent=map_extent, transform=ccrs.PlateCarree(),
-           cmap='Blues', origin='upper', )
+    plt.imshow(flows1, extent=map_extent, transform=ccrs.PlateCarree(),
+               cmap='Blues', origin='upper', )
 
-ax.scatter(xs[outflow_points1], ys[outflow_points1], color="Green", s=5, transform=ccrs.epsg(28355))
-ax.scatter(xs[low_points1], ys[low_points1], color="Red", s=5, transform=ccrs.epsg(28355))
+    ax.scatter(xs[outflow_points1], ys[outflow_points1], color="Green", s=5, transform=ccrs.epsg(28355))
+    ax.scatter(xs[low_points1], ys[low_points1], color="Red", s=5, transform=ccrs.epsg(28355))
 
 
-plt.savefig("WEx4-Flowpath-1.png", dpi=250)
+    plt.savefig("WEx4-Flowpath-1.png", dpi=250)
 # -
 
 # ## Apply pit filling / local-flooding / swamp filling algorithm
@@ -175,23 +220,44 @@ plt.savefig("WEx4-Flowpath-1.png", dpi=250)
 # This should not be necessary but there can be some issues with very flat regions not having sufficient relief for the flow directions
 # to be recorded.
 
-mesh.low_points_local_patch_fill(its=10, smoothing_steps=2)
-topography_2 = mesh.topography.data[:]
-cumulative_flow_2 = mesh.upstream_integral_fn(mesh.topography**2).evaluate(mesh)
-low_points2 = mesh.identify_low_points()
-low_point_coords2 = mesh.coords[low_points2] 
-print("Low points - {}".format(low_points2.shape))
+if not restart:
+    mesh.low_points_local_patch_fill(its=10, smoothing_steps=2)
+    topography_2 = mesh.topography.data[:]
+    cumulative_flow_2 = mesh.upstream_integral_fn(mesh.topography**2).evaluate(mesh)
+    low_points2 = mesh.identify_low_points()
+    low_point_coords2 = mesh.coords[low_points2] 
+    print("Low points - {}".format(low_points2.shape))
 
 
-for i in range(0,20):
-    mesh.low_points_swamp_fill(ref_height=0.0, ref_gradient=0.1)
+    for i in range(0,20):
+        # Check before filling: every swamp fill rebuilds the downhill matrix for the whole mesh
+        # In parallel, we can't break if ANY processor has work to do (barrier / sync issue)
+        low_points3 = mesh.identify_global_low_points()
     
-    # In parallel, we can't break if ANY processor has work to do (barrier / sync issue)
-    low_points3 = mesh.identify_global_low_points()
-    
-    print("{} : {}".format(i,low_points3[0]))
-    if low_points3[0] == 0:
-        break
+        print("{} : {}".format(i,low_points3[0]))
+        if low_points3[0] == 0:
+            break
+
+        mesh.low_points_swamp_fill(ref_height=0.0, ref_gradient=0.1)
+
+# -
+
+# ## Checkpoint the preprocessed mesh
+#
+# Building the mesh and filling the low points is by far the most expensive part of this workflow and it does not need to be repeated every time we want to look at the catchments. We save the mesh, the filled topography and the layout of the DEM image here; on subsequent runs set `restart = True` (where the DEM is read, above) and the `QuagMesh` is rebuilt directly from this file without reading or reprojecting the DEM and with none of the filling iterations. The diagnostics of the unfilled topography (`WEx4-Flowpath-1.png`) are skipped on restart. The plots index the DEM-ordered arrays by mesh node, so the restart checks that the nodes come back in the order they were written.
+
+# +
+if not restart:
+    mesh.save_mesh_to_hdf5(checkpoint_file)
+    mesh.save_field_to_hdf5(checkpoint_file, topography=mesh.topography.data, bmask=mesh.bmask.astype(float))
+    meshtools.generate_xdmf(checkpoint_file)
+
+    # the DEM layout needed to draw the maps without re-reading the DEM
+    import h5py
+
+    with h5py.File(checkpoint_file, mode="r+") as h5:
+        h5.create_dataset("dem/point_mask", data=point_mask)
+        h5.create_dataset("dem/extent", data=np.array([left, right, bottom, top]))
 
 
 # +
@@ -207,7 +273,7 @@ outflow_points3 = np.unique(np.hstack(( mesh.identify_outflow_points(), mesh.ide
 
 # +
 logflow = np.log10(1.0e-3+upstream_area3)
-flows3 = logflow.min() * np.ones_like(height)
+flows3 = logflow.min() * np.ones(point_mask.shape)
 flows3[point_mask] = logflow
 
 plt.figure(figsize=(15, 10))
@@ -331,12 +397,12 @@ for i in range(0,100):
 plt.savefig("WEx4-100Catchments-only.png", dpi=500)
 
 # +
-catch_img = np.zeros_like(height)
+catch_img = np.zeros(point_mask.shape)
 catch_img[point_mask] = catchments.data
 catch_norm = matplotlib.colors.Normalize(vmin=0.0, vmax=5.0)
 
 logflow = np.log10(1.0e-3+upstream_area3)
-flows_img = logflow.min() * np.ones_like(height)
+flows_img = logflow.min() * np.ones(point_mask.shape)
 flows_img[point_mask] = logflow
 flows_norm = matplotlib.colors.Normalize(vmin=-3.0, vmax=10)
 # -
@@ -356,7 +422,8 @@ points = np.column_stack([mesh.tri.points, 0.05*mesh.topography.data])
 low_point_coords3 = points[low_points3]
 outflow_point_coords3 = points[outflow_points3]
 
-low_point_coords1 = points[low_points1]
+if not restart:
+    low_point_coords1 = points[low_points1]
 
 lv = lavavu.Viewer(border=False, background=(0.8,0.9,1.0), resolution=[1200,600], near=-10.0, axis=False)
 
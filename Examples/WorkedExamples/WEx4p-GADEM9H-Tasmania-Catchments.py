@@ -69,8 +69,19 @@ outSpatialRef.ImportFromEPSG(28355) # GDA94 MGA zone 55
 
 transform = osr.CoordinateTransformation(inSpatialRef, outSpatialRef)
 
-transformed_points = transform.TransformPoints(np.c_[x.flat, y.flat])
-transformed_points = np.vstack(transformed_points)
+## Every pixel of the (already clipped) DEM is reprojected: they all feed the interpolation
+## onto the projected grid below, and the point mask is only defined on that grid.
+## Transform in chunks and fill a preallocated array - TransformPoints returns a 
+## python list of tuples which is very expensive to hold for the whole DEM at once
+
+lonlat = np.c_[x.flat, y.flat]
+transformed_points = np.empty_like(lonlat)
+chunk_size = 250000
+
+for start in range(0, lonlat.shape[0], chunk_size):
+    chunk = slice(start, start+chunk_size)
+    transformed_points[chunk] = np.array(transform.TransformPoints(lonlat[chunk]))[:,0:2]
+
 eastings, northings = transformed_points[:,0], transformed_points[:,1]
 
 # +
@@ -196,8 +207,7 @@ print("Low points - {}".format(low_points2.shape))
 
 
 for i in range(0,20):
-    mesh.low_points_swamp_fill(ref_height=0.0, ref_gradient=0.1)
-    
+    # Check before filling: every swamp fill rebuilds the downhill matrix for the whole mesh
     # In parallel, we can't break if ANY processor has work to do (barrier / sync issue)
     low_points3 = mesh.identify_global_low_points()
     
@@ -205,6 +215,8 @@ for i in range(0,20):
     if low_points3[0] == 0:
         break
 
+    mesh.low_points_swamp_fill(ref_height=0.0, ref_gradient=0.1)
+
 
 # +
 cumulative_flow_3 = mesh.upstream_integral_fn(mesh.topography**2).evaluate(mesh)
@@ -168,8 +168,7 @@ print("Low points - {}".format(low_points2.shape))
 
 
 for i in range(0,20):
-    mesh.low_points_swamp_fill(ref_height=0.0, ref_gradient=0.1)
-    
+    # Check before filling: every swamp fill rebuilds the downhill matrix for the whole mesh
     # In parallel, we can't break if ANY processor has work to do (barrier / sync issue)
     low_points3 = mesh.identify_global_low_points()
     
@@ -177,6 +176,8 @@ for i in range(0,20):
     if low_points3[0] == 0:
         break
 
+    mesh.low_points_swamp_fill(ref_height=0.0, ref_gradient=0.1)
+
 
 # +
 cumulative_flow_3 = mesh.upstream_integral_fn(mesh.topography**2).evaluate(mesh)
@@ -61,19 +61,30 @@ mesh = QuagMesh(dm, downhill_neighbours=2)
 x,y = np.meshgrid(lons.data, lats.data)
 height = 6.370 + 1.0e-6 * vals.data 
 
-X,Y,Z = stripy.spherical.lonlat2xyz(np.radians(x.reshape(-1)), np.radians(y.reshape(-1)))
-d,k = mesh.cKDTree.query(np.stack((X,Y,Z)).T)
-
 # +
+## Inverse-distance weighted average of all the raster values that are closest to each mesh node.
+## The raster is processed in chunks (to limit the memory used for the coordinate arrays / tree queries)
+## and the sums for each node are accumulated with bincount rather than a python loop over the samples.
+
+raster_lons = np.radians(x.reshape(-1))
+raster_lats = np.radians(y.reshape(-1))
+raster_height = height.reshape(-1)
+
 weights = np.zeros((mesh.npoints,))
 mesh_height = np.zeros((mesh.npoints,))
 
-d += 1.0e-10
+chunk_size = 1000000
+
+for start in range(0, raster_height.size, chunk_size):
+    chunk = slice(start, start+chunk_size)
+
+    X,Y,Z = stripy.spherical.lonlat2xyz(raster_lons[chunk], raster_lats[chunk])
+    d,k = mesh.cKDTree.query(np.stack((X,Y,Z)).T)
+    inverse_d = 1.0 / (d + 1.0e-10)
+
+    mesh_height += np.bincount(k, weights=raster_height[chunk] * inverse_d, minlength=mesh.npoints)
+    weights     += np.bincount(k, weights=inverse_d, minlength=mesh.npoints)
 
-for i in range(0, height.size):
-    mesh_height[k[i]] += height.reshape(-1)[i] / d[i]
-    weights[k[i]] += 1.0 / d[i]
-    
 mesh_height /= weights
 
 with mesh.deform_topography():